@@ -1,4 +1,3 @@
 set PATH=%PYTHON%;%PYTHON%\Scripts;%PATH%
 
-pip install werkzeug
 pip install .
@@ -11,6 +11,6 @@ in
         coverage run --append --source=usagestats.py --branch tests/__main__.py
         ;;
     check_style)
-        flake8 --ignore=E126 usagestats.py tests contrib/wsgi_server.py
+        flake8 --ignore=E126 usagestats.py tests contrib/wsgi_server.py contrib/compact_reports.py contrib/usagestats_agent.py
         ;;
 esac
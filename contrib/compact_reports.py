@@ -0,0 +1,265 @@
+"""Compacts the reports stored by the WSGI script into daily archives.
+
+Each closed day of ``report_*.txt`` files is rolled into a
+``reports_YYYY-MM-DD.gz`` archive, in which every report is a separate gzip
+member, so the whole archive can still be read with ``zcat``. A
+``reports_YYYY-MM-DD.idx`` file next to it records the name, offset and length
+of each member, so a single report can be read without decompressing the
+rest.
+
+This can be run periodically (e.g. from cron) while the server is receiving
+reports: only days that are over are compacted, new archives are written to
+temporary files and renamed in place, and the original reports are deleted
+only once they are in an archive. A lock file prevents overlapping runs.
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+DESTINATION = '.'  # Current directory
+GRACE_PERIOD = 3600  # Don't touch a day until an hour after it's over
+RETENTION_DAYS = None  # Delete archives older than this, e.g. 365
+
+
+report_name = re.compile(r'^report_([0-9]+)\.[0-9]+\.txt$')
+archive_name = re.compile(r'^reports_([0-9]{4}-[0-9]{2}-[0-9]{2})\.gz$')
+
+
+class AlreadyRunning(Exception):
+    """Another process is compacting the same directory.
+    """
+
+
+@contextlib.contextmanager
+def lock(destination):
+    """Holds the lock on a directory, raises `AlreadyRunning` if taken.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(destination, '.compact.lock'), 'w') as fp:
+        try:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            raise AlreadyRunning(destination)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+def temp_file(destination, name, mode):
+    """Opens a new temporary file next to where `name` will be.
+    """
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp',
+                               dir=destination)
+    return tmp, os.fdopen(fd, mode)
+
+
+def day_of(secs):
+    """Gets the day (UTC) a timestamp belongs to, as 'YYYY-MM-DD'.
+    """
+    return time.strftime('%Y-%m-%d', time.gmtime(secs))
+
+
+def read_index(destination, day):
+    """Reads the index of an archive.
+
+    Returns a list of ``(name, offset, length)`` tuples.
+    """
+    index = []
+    filename = os.path.join(destination, 'reports_%s.idx' % day)
+    if not os.path.exists(filename):
+        return index
+    with open(filename, 'r') as fp:
+        for line in fp:
+            line = line.split()
+            if len(line) == 3:
+                index.append((line[0], int(line[1]), int(line[2])))
+    return index
+
+
+def fetch(name, destination=DESTINATION):
+    """Reads a single report from the archives.
+
+    :param name: The original file name of the report, for example
+    ``report_1500000000.123.txt``.
+    """
+    m = report_name.match(name)
+    if m is None:
+        raise ValueError("Invalid report name %r" % name)
+    day = day_of(int(m.group(1)))
+    for entry, offset, length in read_index(destination, day):
+        if entry == name:
+            archive = os.path.join(destination, 'reports_%s.gz' % day)
+            with open(archive, 'rb') as fp:
+                fp.seek(offset)
+                member = fp.read(length)
+            with gzip.GzipFile(fileobj=io.BytesIO(member), mode='rb') as gz:
+                return gz.read()
+    raise KeyError(name)
+
+
+def compress(data):
+    """Compresses a report as a single gzip member.
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as gz:
+        gz.write(data)
+    return buf.getvalue()
+
+
+def compact_day(destination, day, names):
+    """Adds reports to the archive of a day, then deletes them.
+
+    The caller should hold the `lock()`.
+    """
+    archive = os.path.join(destination, 'reports_%s.gz' % day)
+    index_file = os.path.join(destination, 'reports_%s.idx' % day)
+    index = read_index(destination, day)
+
+    # Write new archive from the old one, the index is only trusted up to the
+    # last entry so any trailing data left by an interrupted run is dropped
+    offset = index[-1][1] + index[-1][2] if index else 0
+    tmp_archive, out = temp_file(destination, 'reports_%s.gz' % day, 'wb')
+    tmp_index = None
+    try:
+        with out:
+            write_archive(out, destination, archive, offset, index, names)
+        tmp_index, out = temp_file(destination, 'reports_%s.idx' % day, 'w')
+        with out:
+            for entry in index:
+                out.write('%s %d %d\n' % entry)
+            out.flush()
+            os.fsync(out.fileno())
+
+        # Archive is renamed first: until the index is, it is only appended to
+        os.rename(tmp_archive, archive)
+        os.rename(tmp_index, index_file)
+    except BaseException:
+        for tmp in (tmp_archive, tmp_index):
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+
+    for name in names:
+        os.remove(os.path.join(destination, name))
+
+
+def write_archive(out, destination, archive, offset, index, names):
+    """Copies the valid part of an archive, then appends reports to it.
+
+    `index` is updated with the reports that were added.
+    """
+    archived = set(entry for entry, _, _ in index)
+    if offset:
+        with open(archive, 'rb') as fp:
+            remaining = offset
+            while remaining:
+                chunk = fp.read(min(remaining, 65536))
+                if not chunk:
+                    raise IOError("Archive %s is truncated" % archive)
+                out.write(chunk)
+                remaining -= len(chunk)
+    for name in names:
+        if name in archived:
+            continue
+        with open(os.path.join(destination, name), 'rb') as fp:
+            member = compress(fp.read())
+        out.write(member)
+        index.append((name, offset, len(member)))
+        offset += len(member)
+    out.flush()
+    os.fsync(out.fileno())
+
+
+def compact(destination=DESTINATION, now=None):
+    """Compacts every day that is over.
+
+    Returns the number of reports that were archived.
+    """
+    if now is None:
+        now = time.time()
+    today = day_of(now - GRACE_PERIOD)
+    with lock(destination):
+        days = {}
+        for name in os.listdir(destination):
+            m = report_name.match(name)
+            if m is not None:
+                day = day_of(int(m.group(1)))
+                if day < today:
+                    days.setdefault(day, []).append(name)
+        total = 0
+        for day, names in sorted(days.items()):
+            names.sort()
+            compact_day(destination, day, names)
+            total += len(names)
+    return total
+
+
+def expire(destination=DESTINATION, retention_days=RETENTION_DAYS, now=None):
+    """Deletes the archives older than the retention period.
+
+    Returns the number of archives that were deleted.
+    """
+    if retention_days is None:
+        return 0
+    if now is None:
+        now = time.time()
+    oldest = day_of(now - retention_days * 86400)
+    deleted = 0
+    with lock(destination):
+        for name in os.listdir(destination):
+            m = archive_name.match(name)
+            if m is not None and m.group(1) < oldest:
+                os.remove(os.path.join(destination, name))
+                index_file = os.path.join(destination,
+                                          'reports_%s.idx' % m.group(1))
+                if os.path.exists(index_file):
+                    os.remove(index_file)
+                deleted += 1
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compacts stored usage reports into daily archives")
+    parser.add_argument('--destination', default=DESTINATION,
+                        help="Directory where the reports are stored")
+    parser.add_argument('--retention-days', type=int, default=RETENTION_DAYS,
+                        help="Delete archives older than this many days")
+    parser.add_argument('--get', metavar='REPORT',
+                        help="Print a single archived report and exit")
+    args = parser.parse_args()
+
+    if args.get:
+        data = fetch(args.get, args.destination)
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        out.write(data)
+        return
+
+    try:
+        archived = compact(args.destination)
+        expired = expire(args.destination, args.retention_days)
+    except AlreadyRunning:
+        sys.stderr.write("Another compaction is running, exiting\n")
+        return
+    sys.stderr.write("Archived %d reports, deleted %d old archives\n" % (
+                     archived, expired))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Local agent forwarding usage reports to the drop point.
+
+Programs pass ``agent_socket=`` to `usagestats.Stats` to hand their reports to
+this agent over a UNIX socket instead of uploading them themselves. The agent
+writes each report to its spool directory before acknowledging it, then
+forwards the spooled reports in batches over a single persistent connection,
+compressed, retrying with backoff while the drop point is unreachable.
+
+Protocol: the client writes the report then shuts down its side of the
+socket. The agent replies on the first line with ``OK``, ``REJECTED <message>``
+if the report is invalid and shouldn't be sent again, or ``ERROR <message>``
+if it couldn't be accepted right now. ``OK`` is followed by ``Name: value``
+lines relaying the drop point's ``X-Usagestats-*`` headers (for example the
+sample rate).
+"""
+
+import argparse
+import gzip
+import io
+import logging
+import os
+import requests
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+
+
+SOCKET = '/run/usagestats/agent.sock'
+SPOOL = '/var/spool/usagestats'
+MAX_SIZE = 524288  # 512 KiB, same as the WSGI script
+MAX_SPOOLED = 100000  # Refuse reports past this many waiting in the spool
+BATCH_SIZE = 50  # Reports sent per wakeup, forwards early once reached
+FLUSH_INTERVAL = 5.0  # Seconds to wait for a full batch before forwarding
+MIN_BACKOFF = 1.0  # First wait after a failed upload, in seconds
+MAX_BACKOFF = 600.0  # Longest wait between retries, in seconds
+
+
+logger = logging.getLogger('usagestats_agent')
+
+
+class Spool(object):
+    """Directory holding the reports waiting to be forwarded.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        self._lock = threading.Lock()
+        self._counter = 0
+        # Set when there are reports to forward, and when there is a batch
+        self.ready = threading.Event()
+        self.full = threading.Event()
+        self.count = len(self.pending())
+        if self.count:
+            self.ready.set()
+        if self.count >= BATCH_SIZE:
+            self.full.set()
+
+    def add(self, report):
+        """Writes a report durably, returns only once it is on disk.
+        """
+        with self._lock:
+            self._counter += 1
+            now = time.time()
+            name = 'report_%d_%03d_%06d.txt' % (
+                int(now), int((now - int(now)) * 1000), self._counter)
+        tmp = os.path.join(self.directory, '.' + name)
+        with open(tmp, 'wb') as fp:
+            fp.write(report)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmp, os.path.join(self.directory, name))
+        with self._lock:
+            self.count += 1
+            if self.count >= BATCH_SIZE:
+                self.full.set()
+        self.ready.set()
+
+    def remove(self, name):
+        """Deletes a report once it has been forwarded.
+        """
+        os.remove(os.path.join(self.directory, name))
+        with self._lock:
+            self.count -= 1
+
+    def pending(self):
+        """Lists the spooled reports, oldest first.
+        """
+        reports = [f for f in os.listdir(self.directory)
+                   if f.startswith('report_')]
+        reports.sort()
+        return reports
+
+
+class Forwarder(threading.Thread):
+    """Background thread uploading the spooled reports.
+    """
+    def __init__(self, spool, drop_point, ssl_verify=None,
+                 flush_interval=FLUSH_INTERVAL):
+        super(Forwarder, self).__init__()
+        self.daemon = True
+        self.spool = spool
+        self.drop_point = drop_point
+        self.flush_interval = flush_interval
+        self.session = requests.Session()
+        if ssl_verify is not None:
+            self.session.verify = ssl_verify
+        self.headers = {}
+        self.backoff = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.spool.ready.wait()
+            # Give other reports a chance to arrive, to send them together
+            self.spool.full.wait(self.flush_interval)
+            self.spool.ready.clear()
+            self.spool.full.clear()
+            self._flush()
+            if self.backoff:
+                self.stopped.wait(self.backoff)
+                # Nothing wakes us up to retry, unless new reports come in
+                if self.spool.count > 0:
+                    self.spool.ready.set()
+        # Last attempt before exiting
+        self._flush()
+
+    def stop(self):
+        """Forwards what can be, then stops the thread.
+        """
+        self.stopped.set()
+        self.spool.ready.set()
+        self.spool.full.set()
+        self.join()
+
+    def _flush(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Error forwarding reports")
+
+    def flush(self):
+        """Forwards a batch of reports.
+        """
+        for name in self.spool.pending()[:BATCH_SIZE]:
+            fullname = os.path.join(self.spool.directory, name)
+            with open(fullname, 'rb') as fp:
+                report = fp.read()
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+                gz.write(report)
+            try:
+                r = self.session.post(
+                    self.drop_point, data=buf.getvalue(), timeout=10,
+                    headers={'Content-Encoding': 'gzip'})
+            except requests.RequestException as e:
+                self._retry_later(name, e)
+                return
+            if r.status_code == 429 or r.status_code >= 500:
+                self._retry_later(name, "HTTP %d" % r.status_code)
+                return
+            self.backoff = 0.0
+            if r.status_code >= 400:
+                logger.warning("Server rejected report %s: %d",
+                               name, r.status_code)
+            else:
+                self.headers = dict(
+                    (k, v) for k, v in r.headers.items()
+                    if k.lower().startswith('x-usagestats-'))
+            self.spool.remove(name)
+        if self.spool.count > 0:
+            self.spool.ready.set()
+            self.spool.full.set()
+
+    def _retry_later(self, name, error):
+        self.backoff = min(max(self.backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+        logger.warning("Couldn't upload %s, retrying in %.1fs: %s",
+                       name, self.backoff, error)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        report = self.rfile.read(MAX_SIZE + 1)
+        if not report:
+            self.reply("REJECTED empty report")
+        elif len(report) > MAX_SIZE:
+            self.reply("REJECTED report too big")
+        elif self.server.spool.count >= MAX_SPOOLED:
+            self.reply("ERROR spool full")
+        else:
+            try:
+                self.server.spool.add(report)
+            except (IOError, OSError) as e:
+                logger.error("Couldn't spool report: %s", e)
+                self.reply("ERROR couldn't store report")
+            else:
+                self.reply("OK", self.server.forwarder.headers)
+
+    def reply(self, status, headers={}):
+        lines = [status]
+        lines.extend('%s: %s' % item for item in headers.items())
+        self.wfile.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, spool, forwarder):
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+        os.chmod(path, 0o666)
+        self.spool = spool
+        self.forwarder = forwarder
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local agent forwarding usage reports")
+    parser.add_argument('drop_point', help="URL reports are forwarded to")
+    parser.add_argument('--socket', default=SOCKET,
+                        help="Path of the UNIX socket to listen on")
+    parser.add_argument('--spool', default=SPOOL,
+                        help="Directory where reports are kept until sent")
+    parser.add_argument('--ssl-verify',
+                        help="CA bundle used to verify the drop point")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    spool = Spool(args.spool)
+    forwarder = Forwarder(spool, args.drop_point, args.ssl_verify)
+    forwarder.start()
+
+    server = Server(args.socket, spool, forwarder)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        forwarder.stop()
+
+
+if __name__ == '__main__':
+    main()
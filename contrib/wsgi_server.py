@@ -4,10 +4,12 @@
 import os
 import re
 import time
+import zlib
 
 
 DESTINATION = '.'  # Current directory
 MAX_SIZE = 524288  # 512 KiB
+SAMPLE_RATE = None  # Fraction of clients that should send reports, e.g. 0.1
 
 
 date_format = re.compile(br'^[0-9]{2,12}\.[0-9]{1,3}$')
@@ -56,13 +58,13 @@ def application(environ, start_response):
         if not isinstance(body, bytes):
             body = body.encode('utf-8')
 
-        start_response(
-            status,
-            [
-                ('Content-Type', 'text/plain'),
-                ('Content-Length', '%d' % len(body)),
-            ],
-        )
+        headers = [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', '%d' % len(body)),
+        ]
+        if SAMPLE_RATE is not None:
+            headers.append(('X-Usagestats-Sample-Rate', '%r' % SAMPLE_RATE))
+        start_response(status, headers)
         return [body]
 
     if environ['REQUEST_METHOD'] != 'POST':
@@ -77,6 +79,16 @@ def application(environ, start_response):
         return send_response('403 Forbidden', "report too big")
     request_body = environ['wsgi.input'].read(request_body_size)
 
+    # Reports forwarded by the agent are compressed
+    if environ.get('HTTP_CONTENT_ENCODING', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            request_body = decompressor.decompress(request_body, MAX_SIZE + 1)
+        except zlib.error:
+            return send_response('400 Bad Request', "invalid compression")
+        if len(request_body) > MAX_SIZE:
+            return send_response('403 Forbidden', "report too big")
+
     # Tries to store
     response_body = store(request_body, environ.get('REMOTE_ADDR'))
     if not response_body:
@@ -0,0 +1,172 @@
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+import usagestats
+
+from tests.utils import regex_compare
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'contrib'))
+import wsgi_server  # noqa: E402
+if hasattr(socket, 'AF_UNIX'):
+    import usagestats_agent
+else:  # Windows
+    usagestats_agent = None
+
+
+optin_prompt = usagestats.Prompt(enable='cool_program --enable-stats',
+                                 disable='cool_program --disable-stats')
+
+
+def status_application(status):
+    def application(environ, start_response):
+        start_response(status, [('Content-Type', 'text/plain')])
+        return [b'nope']
+    return application
+
+
+@unittest.skipIf(usagestats_agent is None, "No UNIX sockets")
+class TestAgent(unittest.TestCase):
+    def setUp(self):
+        if 'PYTHON_USAGE_STATS' in os.environ:
+            del os.environ['PYTHON_USAGE_STATS']
+        self._tdir = tempfile.mkdtemp(prefix='usagestats_tests_agent_')
+        self._recv_dir = os.path.join(self._tdir, 'recv')
+        os.mkdir(self._recv_dir)
+        self._socket = os.path.join(self._tdir, 'agent.sock')
+        self._spool = usagestats_agent.Spool(os.path.join(self._tdir,
+                                                          'spool'))
+        self._collector = None
+        self._server = None
+
+    def tearDown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+        if self._collector is not None:
+            self._collector.stop()
+        shutil.rmtree(self._tdir)
+
+    def _start(self, application):
+        self._collector = usagestats.LoopbackCollector(application).start()
+        forwarder = usagestats_agent.Forwarder(self._spool,
+                                               self._collector.url,
+                                               flush_interval=0.01)
+        self._server = usagestats_agent.Server(self._socket, self._spool,
+                                               forwarder)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.start()
+        return forwarder
+
+    def _submit(self, run):
+        stats = usagestats.Stats(os.path.join(self._tdir, 'client'),
+                                 optin_prompt,
+                                 None,
+                                 version='1.0',
+                                 agent_socket=self._socket)
+        stats.enable_reporting()
+        stats.submit([('run', run)])
+        return stats
+
+    def test_forward(self):
+        """Forwards reports upstream, relays the sample rate back."""
+        old_destination = wsgi_server.DESTINATION
+        old_rate = wsgi_server.SAMPLE_RATE
+        wsgi_server.DESTINATION = self._recv_dir
+        wsgi_server.SAMPLE_RATE = 0.5
+        try:
+            forwarder = self._start(wsgi_server.application)
+            forwarder.start()
+            stats = self._submit(1)
+            self.assertEqual(stats._pending_reports(), [])
+            self.assertIsNone(stats.sample_rate)
+            forwarder.stop()
+
+            # Received compressed, stored by the WSGI script
+            name, = os.listdir(self._recv_dir)
+            with open(os.path.join(self._recv_dir, name), 'rb') as fp:
+                regex_compare(fp.read(),
+                              [br'^submitted_from:127.0.0.1$',
+                               br'^submitted_date:',
+                               br'^date:',
+                               br'^version:1\.0$',
+                               br'^run:1$'],
+                              self.fail)
+            self.assertEqual(self._spool.count, 0)
+            self.assertEqual(self._spool.pending(), [])
+
+            # Next client gets the rate from the agent
+            stats = self._submit(2)
+            self.assertEqual(stats.sample_rate, 0.5)
+            self.assertEqual(self._spool.count, 1)
+        finally:
+            wsgi_server.DESTINATION = old_destination
+            wsgi_server.SAMPLE_RATE = old_rate
+
+    def test_retry(self):
+        """Keeps reports while upstream is unavailable, drops rejected ones."""
+        forwarder = self._start(status_application('503 Unavailable'))
+        self._submit(1)
+        forwarder.flush()
+        self.assertEqual(self._spool.count, 1)
+        self.assertEqual(len(self._spool.pending()), 1)
+        self.assertEqual(forwarder.backoff, 1.0)
+
+        self._collector.stop()
+        self._collector = usagestats.LoopbackCollector(
+            status_application('400 Bad Request')).start()
+        forwarder.drop_point = self._collector.url
+        forwarder.flush()
+        self.assertEqual(self._spool.count, 0)
+        self.assertEqual(self._spool.pending(), [])
+        self.assertEqual(forwarder.backoff, 0.0)
+
+    def test_retry_loop(self):
+        """Forwarder thread tries again on its own once upstream is back."""
+        requests = []
+        recovered = threading.Event()
+
+        def application(environ, start_response):
+            requests.append(environ['wsgi.input'].read(
+                int(environ.get('CONTENT_LENGTH') or 0)))
+            if len(requests) == 1:
+                start_response('503 Unavailable', [])
+            else:
+                start_response('200 OK', [])
+                recovered.set()
+            return [b'']
+
+        old_backoff = usagestats_agent.MIN_BACKOFF
+        usagestats_agent.MIN_BACKOFF = 0.05
+        try:
+            forwarder = self._start(application)
+            forwarder.start()
+            self._submit(1)
+            self.assertTrue(recovered.wait(5))
+            forwarder.stop()
+        finally:
+            usagestats_agent.MIN_BACKOFF = old_backoff
+        # Second upload came from the retry, not the final flush
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(self._spool.count, 0)
+        self.assertEqual(self._spool.pending(), [])
+
+    def test_spool_full(self):
+        """Client keeps its report if the agent can't take it now."""
+        self._start(status_application('200 OK'))
+        old_max = usagestats_agent.MAX_SPOOLED
+        usagestats_agent.MAX_SPOOLED = 1
+        try:
+            self._submit(1)
+            stats = self._submit(2)
+        finally:
+            usagestats_agent.MAX_SPOOLED = old_max
+        self.assertEqual(self._spool.count, 1)
+        self.assertEqual(len(stats._pending_reports()), 1)
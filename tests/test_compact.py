@@ -0,0 +1,120 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'contrib'))
+import compact_reports  # noqa: E402
+
+
+DAY = 86400
+NOW = 1500000000 - 1500000000 % DAY + 12 * 3600  # Noon
+
+
+class TestCompact(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(prefix='usagestats_tests_compact_')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _store(self, secs, msecs):
+        name = 'report_%d.%03d.txt' % (secs, msecs)
+        with open(os.path.join(self._dir, name), 'wb') as fp:
+            fp.write(b'date:%d.%03d\nrun:%d\n' % (secs, msecs, msecs))
+        return name
+
+    def _files(self):
+        return sorted(os.listdir(self._dir))
+
+    def test_compact_fetch(self):
+        """Rolls past days into archives, reports can be read back."""
+        yesterday = self._store(NOW - DAY, 1)
+        self._store(NOW - DAY + 60, 2)
+        older = self._store(NOW - 3 * DAY, 3)
+        today = self._store(NOW - 60, 4)
+
+        self.assertEqual(compact_reports.compact(self._dir, now=NOW), 3)
+        day = compact_reports.day_of(NOW - DAY)
+        self.assertEqual(
+            [f for f in self._files() if not f.startswith('.')],
+            [today,
+             'reports_%s.gz' % compact_reports.day_of(NOW - 3 * DAY),
+             'reports_%s.idx' % compact_reports.day_of(NOW - 3 * DAY),
+             'reports_%s.gz' % day,
+             'reports_%s.idx' % day])
+
+        self.assertEqual(compact_reports.fetch(yesterday, self._dir),
+                         b'date:%d.001\nrun:1\n' % (NOW - DAY))
+        self.assertEqual(compact_reports.fetch(older, self._dir),
+                         b'date:%d.003\nrun:3\n' % (NOW - 3 * DAY))
+        self.assertRaises(KeyError, compact_reports.fetch, today, self._dir)
+
+        # Archive is also a plain gzip file
+        with gzip.open(os.path.join(self._dir,
+                                    'reports_%s.gz' % day)) as fp:
+            self.assertEqual(fp.read().count(b'date:'), 2)
+
+    def test_late_report(self):
+        """Adds reports arriving late to the existing archive."""
+        first = self._store(NOW - DAY, 1)
+        compact_reports.compact(self._dir, now=NOW)
+        late = self._store(NOW - DAY + 60, 2)
+        self.assertEqual(compact_reports.compact(self._dir, now=NOW), 1)
+
+        day = compact_reports.day_of(NOW - DAY)
+        index = compact_reports.read_index(self._dir, day)
+        self.assertEqual([e[0] for e in index], [first, late])
+        self.assertEqual(index[1][1], index[0][1] + index[0][2])
+        self.assertEqual(compact_reports.fetch(first, self._dir),
+                         b'date:%d.001\nrun:1\n' % (NOW - DAY))
+        self.assertEqual(compact_reports.fetch(late, self._dir),
+                         b'date:%d.002\nrun:2\n' % (NOW - DAY + 60))
+
+    def test_interrupted(self):
+        """Recovers from a run interrupted after renaming the archive."""
+        first = self._store(NOW - DAY, 1)
+        compact_reports.compact(self._dir, now=NOW)
+        day = compact_reports.day_of(NOW - DAY)
+
+        # Archive got data that isn't in the index, and the source of an
+        # indexed report wasn't deleted
+        with open(os.path.join(self._dir, 'reports_%s.gz' % day), 'ab') as fp:
+            fp.write(b'garbage')
+        self._store(NOW - DAY, 1)
+        second = self._store(NOW - DAY + 60, 2)
+
+        compact_reports.compact(self._dir, now=NOW)
+        index = compact_reports.read_index(self._dir, day)
+        self.assertEqual([e[0] for e in index], [first, second])
+        self.assertEqual(index[1][1], index[0][1] + index[0][2])
+        self.assertEqual(compact_reports.fetch(second, self._dir),
+                         b'date:%d.002\nrun:2\n' % (NOW - DAY + 60))
+        with open(os.path.join(self._dir, 'reports_%s.gz' % day), 'rb') as fp:
+            self.assertNotIn(b'garbage', fp.read())
+        self.assertFalse([f for f in self._files() if f.endswith('.tmp')])
+
+    @unittest.skipIf(compact_reports.fcntl is None, "No fcntl")
+    def test_locked(self):
+        """Refuses to run while another run holds the lock."""
+        self._store(NOW - DAY, 1)
+        with compact_reports.lock(self._dir):
+            self.assertRaises(compact_reports.AlreadyRunning,
+                              compact_reports.compact, self._dir, NOW)
+        self.assertEqual(compact_reports.compact(self._dir, now=NOW), 1)
+
+    def test_expire(self):
+        """Deletes archives past the retention period."""
+        self._store(NOW - 10 * DAY, 1)
+        self._store(NOW - 2 * DAY, 2)
+        compact_reports.compact(self._dir, now=NOW)
+        self.assertEqual(compact_reports.expire(self._dir, None, now=NOW), 0)
+        self.assertEqual(compact_reports.expire(self._dir, 5, now=NOW), 1)
+        day = compact_reports.day_of(NOW - 2 * DAY)
+        self.assertEqual(
+            [f for f in self._files() if not f.startswith('.')],
+            ['reports_%s.gz' % day, 'reports_%s.idx' % day])
@@ -1,10 +1,12 @@
 import functools
 import os
+import requests
 import shutil
 import signal
-import subprocess
+import socket
 import sys
 import tempfile
+import threading
 import time
 import unittest
 
@@ -12,6 +14,10 @@ import usagestats
 
 from tests.utils import capture_stderr, regex_compare
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                os.pardir, 'contrib'))
+import wsgi_server  # noqa: E402
+
 
 optin_prompt = usagestats.Prompt(enable='cool_program --enable-stats',
                                  disable='cool_program --disable-stats')
@@ -37,33 +43,20 @@ class TestReporting(unittest.TestCase):
         if 'PYTHON_USAGE_STATS' in os.environ:
             del os.environ['PYTHON_USAGE_STATS']
         cls._recv_dir = tempfile.mkdtemp(prefix='usagestats_tests_server_')
-        os.environ['USAGESTATS_SERVER_USE_WERKZEUG'] = 'yes'
-        cls._wsgi_process = subprocess.Popen(
-                [sys.executable,
-                 os.path.abspath(os.path.join(os.path.dirname(__file__),
-                                              os.pardir,
-                                              'contrib',
-                                              'wsgi_server.py'))],
-                cwd=cls._recv_dir)
-        time.sleep(2)
+        wsgi_server.DESTINATION = cls._recv_dir
+        cls._collector = usagestats.LoopbackCollector(
+            wsgi_server.application).start()
+        cls._url = cls._collector.url
 
     @classmethod
     def tearDownClass(cls):
-        cls._wsgi_process.send_signal(signal.SIGTERM)
-        cls._wsgi_process.wait()
+        cls._collector.stop()
         shutil.rmtree(cls._recv_dir)
 
     def _get_reports(self, tdir, expected=0):
-        # Give .5s to the server to process the request and write a file
-        time.sleep(0.5)
+        # The collector writes the file before answering, so it is already
+        # there when submit() returns
         lst = list(os.listdir(self._recv_dir))
-        # This cheats a little by waiting a bit more (max 5s) if the expected
-        # number of files is not there
-        nb = 1
-        while nb < 10 and len(lst) < expected:
-            time.sleep(0.5)
-            nb += 1
-            lst = list(os.listdir(self._recv_dir))
         self.assertEqual(len(lst), expected)
         results = []
         for name in sorted(lst):
@@ -77,7 +70,7 @@ class TestReporting(unittest.TestCase):
         with capture_stderr() as lines:
             stats = usagestats.Stats(tdir,
                                      optin_prompt,
-                                     'http://127.0.0.1:8000/',
+                                     self._url,
                                      unique_user_id=True,
                                      version='1.0')
             stats.note({'mode': 'compatibility'})
@@ -98,7 +91,7 @@ class TestReporting(unittest.TestCase):
         with capture_stderr() as lines:
             stats = usagestats.Stats(tdir,
                                      optin_prompt,
-                                     'http://127.0.0.1:8000/',
+                                     self._url,
                                      unique_user_id=True,
                                      version='1.0')
             stats.enable_reporting()
@@ -111,7 +104,7 @@ class TestReporting(unittest.TestCase):
         with capture_stderr() as lines:
             stats = usagestats.Stats(tdir,
                                      optin_prompt,
-                                     'http://127.0.0.1:8000/',
+                                     self._url,
                                      unique_user_id=True,
                                      version='1.0')
             stats.note({'mode': 'compatibility'})
@@ -139,7 +132,7 @@ class TestReporting(unittest.TestCase):
         with capture_stderr() as lines:
             stats = usagestats.Stats(tdir,
                                      optin_prompt,
-                                     'http://127.0.0.1:8000/',
+                                     self._url,
                                      unique_user_id=True,
                                      version='1.0')
             stats.enable_reporting()
@@ -162,3 +155,539 @@ class TestReporting(unittest.TestCase):
                        br'^mode:yep$',
                        br'^python:'],
                       self.fail)
+
+    @temp_recv_dir
+    def test_evict_pending(self, tdir):
+        """Drops the oldest stored reports once the limits are exceeded."""
+        for i in range(5):
+            with capture_stderr():
+                stats = usagestats.Stats(tdir,
+                                         optin_prompt,
+                                         self._url,
+                                         version='1.0',
+                                         max_pending_reports=3)
+                stats.submit([('run', i)])
+            time.sleep(0.01)
+
+        reports = stats._pending_reports()
+        self.assertEqual(len(reports), 3)
+        runs = []
+        for name in reports:
+            with open(os.path.join(tdir, name), 'rb') as fp:
+                runs.append(fp.read().splitlines()[-1])
+        self.assertEqual(runs, [b'run:2', b'run:3', b'run:4'])
+
+        with capture_stderr():
+            stats = usagestats.Stats(tdir,
+                                     optin_prompt,
+                                     self._url,
+                                     version='1.0',
+                                     max_pending_bytes=1)
+            stats.submit([('run', 5)])
+        self.assertEqual(stats._pending_reports(), [])
+        self._get_reports(tdir, 0)
+
+    @temp_recv_dir
+    def test_sampling(self, tdir):
+        """Drops unsampled reports, records the rate in sampled ones."""
+        with capture_stderr() as lines:
+            stats = usagestats.Stats(tdir,
+                                     optin_prompt,
+                                     self._url,
+                                     version='1.0',
+                                     sample_rate=0.0)
+            stats.enable_reporting()
+            stats.submit([('what', 'Ran the program')])
+        self.assertEqual(lines, [])
+        self.assertEqual(stats._pending_reports(), [])
+        self._get_reports(tdir, 0)
+
+        # Rate pushed down by the server overrides the one from the code
+        with open(os.path.join(tdir, 'sample_rate'), 'w') as fp:
+            fp.write('1.0 %d 0.0\n' % time.time())
+        with capture_stderr() as lines:
+            stats = usagestats.Stats(tdir,
+                                     optin_prompt,
+                                     self._url,
+                                     version='1.0',
+                                     sample_rate=0.0)
+            stats.submit([('what', 'Ran the program')])
+        self.assertEqual(lines, [])
+        report, = self._get_reports(tdir, 1)
+        regex_compare(report,
+                      [br'^submitted_from:127.0.0.1$',
+                       br'^submitted_date:',
+                       br'^date:',
+                       br'^version:1\.0$',
+                       br'^what:Ran the program$',
+                       br'^sample_rate:1\.0$'],
+                      self.fail)
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "No UNIX sockets")
+    @temp_recv_dir
+    def test_agent(self, tdir):
+        """Hands the report to a local agent over a UNIX socket."""
+        path = os.path.join(tdir, 'agent.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+        received = []
+
+        def agent():
+            conn, _ = listener.accept()
+            data = []
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data.append(chunk)
+            received.append(b''.join(data))
+            conn.sendall(b'OK\nX-Usagestats-Sample-Rate: 0.5\n')
+            conn.close()
+
+        thread = threading.Thread(target=agent)
+        thread.start()
+        try:
+            with capture_stderr() as lines:
+                stats = usagestats.Stats(tdir,
+                                         optin_prompt,
+                                         None,
+                                         version='1.0',
+                                         agent_socket=path)
+                stats.enable_reporting()
+                stats.submit([('what', 'Ran the program')])
+        finally:
+            thread.join()
+            listener.close()
+
+        self.assertEqual(lines, [])
+        report, = received
+        regex_compare(report,
+                      [br'^date:',
+                       br'^version:1\.0$',
+                       br'^what:Ran the program$'],
+                      self.fail)
+        self.assertEqual(stats.sample_rate, 0.5)
+        self.assertEqual(stats._pending_reports(), [])
+        self._get_reports(tdir, 0)
+
+
+class SlowServer(object):
+    """HTTP server sending its response one line every 0.4s.
+    """
+    def __init__(self):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(5)
+        self._listener.settimeout(0.05)
+        self.url = 'http://127.0.0.1:%d/' % self._listener.getsockname()[1]
+        self._stop = threading.Event()
+        self._answers = []
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._listener.accept()
+            except socket.timeout:
+                continue
+            thread = threading.Thread(target=self._answer, args=(conn,))
+            thread.start()
+            self._answers.append(thread)
+
+    def _answer(self, conn):
+        try:
+            conn.recv(65536)
+            conn.sendall(b'HTTP/1.1 200 OK\r\n')
+            for i in range(5):
+                if self._stop.wait(0.4):
+                    return
+                conn.sendall(('X-Slow-%d: yes\r\n' % i).encode('ascii'))
+            conn.sendall(b'Content-Length: 0\r\n\r\n')
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        for thread in self._answers:
+            thread.join()
+        self._listener.close()
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self._tdir = tempfile.mkdtemp(prefix='usagestats_tests_send_')
+
+    def tearDown(self):
+        shutil.rmtree(self._tdir)
+
+    def test_memory(self):
+        """Sends reports to memory, keeps them when sending fails."""
+        transport = usagestats.MemoryTransport()
+        transport.error = usagestats.UploadError("unreachable")
+        stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                 version='1.0', transport=transport)
+        stats.enable_reporting()
+        stats.submit([('run', 1)])
+        self.assertEqual(transport.reports, [])
+        self.assertEqual(len(stats._pending_reports()), 1)
+
+        transport.error = None
+        stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                 version='1.0', transport=transport)
+        stats.submit([('run', 2)])
+        self.assertEqual([r.splitlines()[-1] for r in transport.reports],
+                         [b'run:1', b'run:2'])
+        self.assertEqual(stats._pending_reports(), [])
+
+    def test_loopback(self):
+        """Uploads to the in-process collector, which sets the sample rate."""
+        headers = {'X-Usagestats-Sample-Rate': '0.25'}
+        with usagestats.LoopbackCollector(headers=headers) as collector:
+            stats = usagestats.Stats(self._tdir, optin_prompt, collector.url,
+                                     version='1.0')
+            stats.enable_reporting()
+            stats.submit([('what', 'Ran the program')])
+            report, = collector.wait_for(1)
+        regex_compare(report,
+                      [br'^date:',
+                       br'^version:1\.0$',
+                       br'^what:Ran the program$'],
+                      self.fail)
+        with open(os.path.join(self._tdir, 'sample_rate')) as fp:
+            self.assertEqual(fp.read().split()[0], '0.25')
+
+    def test_http_errors(self):
+        """Only client errors are rejections, others are tried again."""
+        for status, error in [('400 Bad Request', usagestats.ReportRejected),
+                              ('413 Too Large', usagestats.ReportRejected),
+                              ('429 Too Many', usagestats.UploadError),
+                              ('503 Unavailable', usagestats.UploadError)]:
+            def application(environ, start_response):
+                start_response(status, [('Content-Type', 'text/plain')])
+                return [b'nope']
+
+            with usagestats.LoopbackCollector(application) as collector:
+                transport = usagestats.HttpTransport(collector.url)
+                with self.assertRaises(usagestats.UploadError) as cm:
+                    transport.send(b'run:1\n', 1)
+            self.assertIs(type(cm.exception), error)
+
+    def test_sample_rate_refresh(self):
+        """Rate from the server expires, backlog is sent even if unsampled."""
+        transport = usagestats.MemoryTransport(
+            headers={'X-Usagestats-Sample-Rate': '0'})
+
+        def submit(run, sample_rate=None):
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport,
+                                     sample_rate=sample_rate)
+            stats.enable_reporting()
+            stats.submit([('run', run)])
+            time.sleep(0.01)
+            return stats
+
+        def runs():
+            return [line for r in transport.reports
+                    for line in r.splitlines() if line.startswith(b'run:')]
+
+        # Server stops reports
+        submit(1)
+        stats = submit(2)
+        self.assertEqual(runs(), [b'run:1'])
+        self.assertEqual(stats.sample_rate, 0.0)
+
+        # After a day, reports are sent again, getting the new rate
+        rate_file = os.path.join(self._tdir, 'sample_rate')
+        with open(rate_file, 'w') as fp:
+            fp.write('0.0 %d None\n' % (time.time() - 90000))
+        transport.headers = {'X-Usagestats-Sample-Rate': '1'}
+        stats = submit(3)
+        self.assertEqual(runs(), [b'run:1', b'run:3'])
+        self.assertEqual(stats.sample_rate, 1.0)
+
+        # Rate from the server is ignored if the program's changed
+        with open(rate_file, 'w') as fp:
+            fp.write('1.0 %d None\n' % time.time())
+        transport.headers = {}
+        stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                 version='1.0', transport=transport,
+                                 sample_rate=0.5)
+        self.assertEqual(stats.sample_rate, 0.5)
+
+        # Previous reports are sent even if the current one is dropped
+        transport.error = usagestats.UploadError("unreachable")
+        submit(4)
+        transport.error = None
+        stats = submit(5, sample_rate=0.0)
+        self.assertEqual(runs(), [b'run:1', b'run:3', b'run:4'])
+        self.assertEqual(stats._pending_reports(), [])
+
+    def test_auto_submit(self):
+        """Submits on exit, saving the report if uploading is too slow."""
+        previous = signal.getsignal(signal.SIGTERM)
+        try:
+            transport = usagestats.MemoryTransport()
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport)
+            stats.enable_reporting()
+            stats.auto_submit([('run', 1)], budget=0.5)
+            self.assertNotEqual(signal.getsignal(signal.SIGTERM), previous)
+            stats._run_auto_submit()
+            self.assertEqual(len(transport.reports), 1)
+            self.assertEqual(len(stats.read_latencies()), 1)
+
+            # Last upload took too long, so don't try
+            with open(os.path.join(self._tdir, 'latency'), 'w') as fp:
+                fp.write('%d 0.800\n' % time.time())
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport)
+            stats.auto_submit([('run', 2)], budget=0.5)
+            stats._run_auto_submit()
+            self.assertEqual(len(transport.reports), 1)
+            self.assertEqual(len(stats._pending_reports()), 1)
+
+            # A single slow upload doesn't prevent the next ones
+            now = time.time()
+            with open(os.path.join(self._tdir, 'latency'), 'w') as fp:
+                for when, latency in [(60, 0.01), (30, 0.8), (0, 0.01)]:
+                    fp.write('%d %.3f\n' % (now - when, latency))
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport)
+            stats.auto_submit([('run', 3)], budget=0.5)
+            stats._run_auto_submit()
+            self.assertEqual(len(transport.reports), 3)
+            self.assertEqual(stats._pending_reports(), [])
+
+            # Try again after an hour, in case the network got better
+            with open(os.path.join(self._tdir, 'latency'), 'w') as fp:
+                fp.write('%d 0.800\n' % (time.time() - 4000))
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport)
+            stats.auto_submit([('run', 4)], budget=0.5)
+            stats._run_auto_submit()
+            self.assertEqual(len(transport.reports), 4)
+
+            # Measurements from more than a day ago are ignored
+            with open(os.path.join(self._tdir, 'latency'), 'w') as fp:
+                fp.write('%d 0.800\n' % (time.time() - 90000))
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport)
+            stats.auto_submit([('run', 5)], budget=0.5)
+            stats._run_auto_submit()
+            self.assertEqual([r.splitlines()[-1] for r in transport.reports],
+                             [b'run:1', b'run:2', b'run:3', b'run:4',
+                              b'run:5'])
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+    def test_parallel_drain(self):
+        """Uploads previous reports concurrently, failing per file."""
+        class FlakyTransport(usagestats.MemoryTransport):
+            def send(self, report, timeout):
+                if self.error is None and b'run:1\n' in report:
+                    raise usagestats.UploadError("flaky")
+                return super(FlakyTransport, self).send(report, timeout)
+
+        transport = FlakyTransport()
+        transport.error = usagestats.UploadError("unreachable")
+        for i in range(6):
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport)
+            stats.enable_reporting()
+            stats.submit([('run', i)])
+            time.sleep(0.01)
+        self.assertEqual(len(stats._pending_reports()), 6)
+
+        transport.error = None
+        stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                 version='1.0', transport=transport,
+                                 drain_workers=3, drain_budget=5)
+        stats.submit([('run', 6)])
+        self.assertEqual(sorted(r.splitlines()[-1]
+                                for r in transport.reports),
+                         [b'run:0', b'run:2', b'run:3', b'run:4', b'run:5',
+                          b'run:6'])
+        self.assertEqual(transport.reports[-1].splitlines()[-1], b'run:6')
+        pending, = stats._pending_reports()
+        with open(os.path.join(self._tdir, pending), 'rb') as fp:
+            self.assertEqual(fp.read().splitlines()[-1], b'run:1')
+
+    def _check_budget(self):
+        server = SlowServer()
+        try:
+            stats = usagestats.Stats(self._tdir, optin_prompt, server.url,
+                                     version='1.0')
+            stats.enable_reporting()
+            stats.auto_submit([('run', 1)], budget=0.5)
+            start = time.time()
+            stats._run_auto_submit()
+            elapsed = time.time() - start
+        finally:
+            server.close()
+        self.assertLess(elapsed, 0.7)
+        self.assertEqual(len(stats._pending_reports()), 1)
+        latency, = stats.read_latencies()
+        self.assertGreaterEqual(latency[1], 0.4)
+
+    def test_auto_submit_slow_server(self):
+        """Abandons an upload that doesn't fit in the budget."""
+        previous = signal.getsignal(signal.SIGTERM)
+        try:
+            self._check_budget()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+    @unittest.skipUnless(hasattr(signal, 'setitimer'), "No setitimer")
+    def test_auto_submit_slow_server_shutdown(self):
+        """Abandons a slow upload even when threads can't be started."""
+        previous = signal.getsignal(signal.SIGTERM)
+        start_thread = threading.Thread.start
+
+        def start(thread):
+            if thread.daemon:  # Refuse the upload thread only
+                raise RuntimeError("can't create new thread at interpreter "
+                                   "shutdown")
+            start_thread(thread)
+
+        threading.Thread.start = start
+        try:
+            self._check_budget()
+        finally:
+            threading.Thread.start = start_thread
+            signal.signal(signal.SIGTERM, previous)
+
+    def test_connection_reuse(self):
+        """Uploads with a deadline share one thread and one session."""
+        sessions = []
+        started = []
+        make_session = requests.Session
+        start_thread = threading.Thread.start
+
+        def session():
+            sessions.append(make_session())
+            return sessions[-1]
+
+        def start(thread):
+            started.append(thread)
+            start_thread(thread)
+
+        with usagestats.LoopbackCollector() as collector:
+            transport = usagestats.MemoryTransport()
+            transport.error = usagestats.UploadError("unreachable")
+            for i in range(6):
+                stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                         version='1.0', transport=transport)
+                stats.enable_reporting()
+                stats.submit([('run', i)])
+                time.sleep(0.01)
+
+            requests.Session = session
+            threading.Thread.start = start
+            try:
+                stats = usagestats.Stats(self._tdir, optin_prompt,
+                                         collector.url, version='1.0',
+                                         drain_budget=5)
+                stats.submit([('run', 6)])
+            finally:
+                requests.Session = make_session
+                threading.Thread.start = start_thread
+            self.assertEqual(len(collector.wait_for(7)), 7)
+        self.assertEqual(stats._pending_reports(), [])
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(len(started), 1)
+        sessions[0].close()
+
+    def test_drain_rejected(self):
+        """Deletes previous reports that the server rejects."""
+        class RejectingTransport(usagestats.MemoryTransport):
+            def send(self, report, timeout):
+                if self.error is None and b'run:1\n' in report:
+                    raise usagestats.ReportRejected("invalid")
+                return super(RejectingTransport, self).send(report, timeout)
+
+        transport = RejectingTransport()
+        transport.error = usagestats.UploadError("unreachable")
+        for i in range(3):
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport)
+            stats.enable_reporting()
+            stats.submit([('run', i)])
+            time.sleep(0.01)
+
+        for workers in (1, 2):
+            transport.error = None
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport,
+                                     drain_workers=workers, drain_budget=5)
+            stats.submit([('run', 3 + workers)])
+            self.assertEqual(stats._pending_reports(), [])
+        self.assertEqual(sorted(r.splitlines()[-1]
+                                for r in transport.reports),
+                         [b'run:0', b'run:2', b'run:4', b'run:5'])
+
+    def test_drain_unavailable(self):
+        """Keeps previous reports while the server is unavailable."""
+        def application(environ, start_response):
+            start_response('503 Unavailable', [('Content-Type', 'text/plain')])
+            return [b'nope']
+
+        with usagestats.LoopbackCollector(application) as collector:
+            for i in range(4):
+                stats = usagestats.Stats(self._tdir, optin_prompt,
+                                         collector.url, version='1.0')
+                stats.enable_reporting()
+                stats.submit([('run', i)])
+                time.sleep(0.01)
+        self.assertEqual(len(stats._pending_reports()), 4)
+
+    def test_drain_at_shutdown(self):
+        """Drains serially if threads can't be started during exit."""
+        transport = usagestats.MemoryTransport()
+        transport.error = usagestats.UploadError("unreachable")
+        for i in range(3):
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport)
+            stats.enable_reporting()
+            stats.submit([('run', i)])
+            time.sleep(0.01)
+        transport.error = None
+
+        previous = signal.getsignal(signal.SIGTERM)
+        start_thread = threading.Thread.start
+
+        def start(thread):
+            raise RuntimeError("can't create new thread at interpreter "
+                               "shutdown")
+
+        try:
+            stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                     version='1.0', transport=transport,
+                                     drain_workers=3, drain_budget=5)
+            stats.auto_submit([('run', 3)], budget=2)
+            threading.Thread.start = start
+            stats._run_auto_submit()
+        finally:
+            threading.Thread.start = start_thread
+            signal.signal(signal.SIGTERM, previous)
+        self.assertEqual([r.splitlines()[-1] for r in transport.reports],
+                         [b'run:0', b'run:1', b'run:2', b'run:3'])
+        self.assertEqual(stats._pending_reports(), [])
+
+    def test_save_on_error(self):
+        """Saves the current report if sending fails unexpectedly."""
+        class BrokenTransport(usagestats.Transport):
+            def send(self, report, timeout):
+                raise KeyError("bug")
+
+        stats = usagestats.Stats(self._tdir, optin_prompt, None,
+                                 version='1.0', transport=BrokenTransport())
+        stats.enable_reporting()
+        self.assertRaises(KeyError, stats.submit, [('run', 1)])
+        pending, = stats._pending_reports()
+        with open(os.path.join(self._tdir, pending), 'rb') as fp:
+            self.assertEqual(fp.read().splitlines()[-1], b'run:1')
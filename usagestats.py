@@ -1,11 +1,21 @@
 import distro
+import hashlib
 import logging
 import os
 import platform
+import random
 import requests
+import signal
+import socket
+import threading
 import time
 import sys
 
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
 
 __version__ = '1.0.1'
 
@@ -19,6 +29,84 @@ except ImportError:
 logger = logging.getLogger('usagestats')
 
 
+class UploadError(Exception):
+    """A report couldn't be delivered, it should be kept for later.
+    """
+
+
+class ReportRejected(UploadError):
+    """A report was received but refused, sending it again won't help.
+    """
+
+
+class _DeadlineExceeded(UploadError):
+    pass
+
+
+class _Uploader(object):
+    """Makes calls on a long-lived daemon thread, giving up at a deadline.
+
+    A call that is too slow is abandoned, the thread keeps running it and the
+    following calls wait behind it. If the thread can't be started (the
+    interpreter is shutting down), a SIGALRM timer interrupts the call
+    instead, if we are on the main thread.
+    """
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._thread = None
+
+    def call(self, deadline, func, *args):
+        """Calls a function, giving up if it hasn't returned by `deadline`.
+        """
+        if self._thread is None:
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            try:
+                thread.start()
+            except RuntimeError:
+                return _call_with_alarm(deadline, func, *args)
+            self._thread = thread
+        done = threading.Event()
+        result = []
+        self._jobs.put((func, args, done, result))
+        done.wait(max(0, deadline - time.time()))
+        if not result:
+            raise _DeadlineExceeded("timed out")
+        success, value = result[0]
+        if success:
+            return value
+        raise value
+
+    def _run(self):
+        while True:
+            func, args, done, result = self._jobs.get()
+            try:
+                result.append((True, func(*args)))
+            except BaseException as e:
+                result.append((False, e))
+            done.set()
+
+
+def _call_with_alarm(deadline, func, *args):
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise _DeadlineExceeded("timed out")
+
+    def on_alarm(signum, frame):
+        raise _DeadlineExceeded("timed out")
+
+    try:
+        previous = signal.signal(signal.SIGALRM, on_alarm)
+    except (AttributeError, ValueError):  # Windows, or not the main thread
+        return func(*args)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
 class Prompt(object):
     """The reporting prompt, asking the user to enable or disable the system.
     """
@@ -99,6 +187,201 @@ def _encode(s):
     return s
 
 
+class Transport(object):
+    """How reports get to the drop point.
+
+    Subclass this and pass it to `Stats` to deliver reports some other way.
+    """
+    def send(self, report, timeout):
+        """Delivers a single report.
+
+        :param report: The report, as bytes.
+        :param timeout: Time in seconds after which to give up.
+        :returns: The headers of the response, as a dictionary.
+        :raises UploadError: if the report should be sent again later.
+        :raises ReportRejected: if the report was refused and should be
+        dropped.
+        """
+        raise NotImplementedError
+
+
+class HttpTransport(Transport):
+    """POSTs the reports to the drop point.
+
+    Connections are reused for all the reports sent by this object, from any
+    thread.
+    """
+    def __init__(self, drop_point, ssl_verify=None):
+        self.drop_point = drop_point
+        self.ssl_verify = ssl_verify
+        self._session = None
+        self._lock = threading.Lock()
+
+    def send(self, report, timeout):
+        with self._lock:
+            if self._session is None:
+                self._session = requests.Session()
+            session = self._session
+        try:
+            r = session.post(self.drop_point, data=report,
+                             timeout=timeout, verify=self.ssl_verify)
+        except requests.RequestException as e:
+            raise UploadError(str(e))
+        try:
+            r.raise_for_status()
+        except requests.RequestException as e:
+            # Server unavailable or overloaded, the report can be sent later
+            if r.status_code == 429 or r.status_code >= 500:
+                raise UploadError(str(e))
+            raise ReportRejected(str(e))
+        return r.headers
+
+
+class AgentTransport(Transport):
+    """Hands the reports to a local agent over its UNIX socket.
+
+    See ``contrib/usagestats_agent.py``. The report is written and the socket
+    shut down for writing; the agent replies with ``OK``,
+    ``REJECTED <message>`` or ``ERROR <message>`` (try again later) on the
+    first line, followed by ``Name: value`` headers relayed from the drop
+    point.
+    """
+    def __init__(self, path):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError("UNIX sockets are not available on this "
+                             "platform, can't use the agent")
+        self.path = path
+
+    def send(self, report, timeout):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(self.path)
+            sock.sendall(report)
+            sock.shutdown(socket.SHUT_WR)
+            reply = []
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                reply.append(chunk)
+        except (socket.error, OSError) as e:
+            raise UploadError("agent: %s" % e)
+        finally:
+            sock.close()
+        lines = b''.join(reply).decode('utf-8', 'replace').splitlines()
+        if not lines:
+            raise UploadError("agent: empty reply")
+        if lines[0].startswith('REJECTED'):
+            raise ReportRejected("agent: %s" % lines[0])
+        elif lines[0] != 'OK':
+            raise UploadError("agent: %s" % lines[0])
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+
+class MemoryTransport(Transport):
+    """Keeps the reports in memory, in the `reports` list.
+
+    Useful for tests and benchmarks. Set `error` to an `UploadError` to make
+    sending fail, and `headers` to simulate the drop point's responses.
+    """
+    def __init__(self, headers=None):
+        self.reports = []
+        self.headers = headers if headers is not None else {}
+        self.error = None
+
+    def send(self, report, timeout):
+        if self.error is not None:
+            raise self.error
+        self.reports.append(report)  # list.append() is atomic
+        return self.headers
+
+
+class LoopbackCollector(object):
+    """A drop point running on a thread of the current process.
+
+    By default, the received reports are kept in the `reports` list; use
+    `wait_for()` to wait for them to arrive. A WSGI `application` can be given
+    instead, for example the one from ``contrib/wsgi_server.py``.
+
+    Use it as a context manager, or call `start()` and `stop()`; `url` is the
+    address to pass to `Stats` as the drop point.
+    """
+    def __init__(self, application=None, headers=None):
+        self.application = application or self._store
+        self.headers = headers if headers is not None else {}
+        self.reports = []
+        self.url = None
+        self.ready = threading.Event()
+        self._received = threading.Condition()
+        self._server = None
+        self._thread = None
+
+    def _store(self, environ, start_response):
+        try:
+            size = int(environ['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            size = 0
+        report = environ['wsgi.input'].read(size)
+        with self._received:
+            self.reports.append(report)
+            self._received.notify_all()
+        headers = [('Content-Type', 'text/plain'), ('Content-Length', '6')]
+        headers.extend(self.headers.items())
+        start_response('200 OK', headers)
+        return [b'stored']
+
+    def _serve(self):
+        from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        self._server = make_server('127.0.0.1', 0, self.application,
+                                   handler_class=QuietHandler)
+        self.url = 'http://127.0.0.1:%d/' % self._server.server_port
+        self.ready.set()
+        self._server.serve_forever(poll_interval=0.05)
+
+    def start(self):
+        """Starts the server, returns once it accepts connections.
+        """
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def wait_for(self, count, timeout=5):
+        """Waits until `count` reports have been received, returns them.
+        """
+        deadline = time.time() + timeout
+        with self._received:
+            while len(self.reports) < count:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._received.wait(remaining)
+            return list(self.reports)
+
+
 class Stats(object):
     """Usage statistics collection and reporting.
 
@@ -132,12 +415,37 @@ class Stats(object):
     def __init__(self, location, prompt, drop_point,
                  version, unique_user_id=False,
                  env_var='PYTHON_USAGE_STATS',
-                 ssl_verify=None):
+                 ssl_verify=None,
+                 max_pending_reports=None, max_pending_bytes=None,
+                 sample_rate=None, agent_socket=None, transport=None,
+                 drain_workers=1, drain_budget=None):
         """Start a report for later submission.
 
         This creates a report object that you can fill with data using
         `note()`, until you finally upload it (or not, depending on
         configuration) using `submit()`.
+
+        :param max_pending_reports: Maximum number of reports kept on disk
+        waiting to be uploaded. Once exceeded, the oldest ones are deleted.
+        :param max_pending_bytes: Maximum total size of the reports kept on
+        disk waiting to be uploaded. Once exceeded, the oldest ones are
+        deleted.
+        :param sample_rate: Fraction of the reports to keep, between 0 and 1.
+        If a user ID is used, the same users are consistently sampled;
+        otherwise each report is kept at random. The drop point can override
+        this value in its responses, for a day.
+        :param agent_socket: Path to the UNIX socket of a local agent (see
+        ``contrib/usagestats_agent.py``). If set, reports are handed to that
+        agent, which forwards them to the drop point, instead of being
+        uploaded directly.
+        :param transport: A `Transport` used to send the reports. By default,
+        an `HttpTransport` to `drop_point`, or an `AgentTransport` if
+        `agent_socket` is set.
+        :param drain_workers: Number of previous reports uploaded at the same
+        time. With 1, they are sent one after the other, stopping at the first
+        failure.
+        :param drain_budget: Time in seconds to spend uploading previous
+        reports. If unset, at most 4 of them are sent.
         """
         self.started_time = time.time()
 
@@ -162,6 +470,18 @@ class Stats(object):
         self.location = os.path.expanduser(location)
         self.drop_point = drop_point
         self.version = version
+        self.max_pending_reports = max_pending_reports
+        self.max_pending_bytes = max_pending_bytes
+        self.sample_rate = self.default_sample_rate = sample_rate
+        self.agent_socket = agent_socket
+        self.drain_workers = drain_workers
+        self.drain_budget = drain_budget
+        if transport is not None:
+            self.transport = transport
+        elif agent_socket is not None:
+            self.transport = AgentTransport(agent_socket)
+        else:
+            self.transport = HttpTransport(drop_point, self.ssl_verify)
 
         if isinstance(prompt, Prompt):
             self.prompt = prompt
@@ -185,7 +505,13 @@ class Stats(object):
         else:
             self.user_id = None
 
+        if self.enabled:
+            self.read_sample_rate()
+
         self.notes = []
+        self._latencies = []
+        self._uploader = _Uploader()
+        self._auto_submit = None
 
         self.note([('version', self.version)])
 
@@ -245,6 +571,75 @@ class Stats(object):
             else:
                 raise ValueError("Unknown reporting state %r" % enabled)
 
+    def read_sample_rate(self):
+        """Reads the sampling rate last sent by the drop point, if any.
+
+        That rate is only used for a day, after which the one given to the
+        constructor applies again, until the drop point sends a new one. It
+        is also ignored if the rate given to the constructor has changed since
+        it was received.
+        """
+        rate_file = os.path.join(self.location, 'sample_rate')
+        if not os.path.exists(rate_file):
+            return
+        with open(rate_file, 'r') as fp:
+            fields = fp.read().split()
+        if len(fields) != 3:
+            return
+        rate = self._parse_sample_rate(fields[0])
+        try:
+            when = float(fields[1])
+        except ValueError:
+            return
+        if rate is None or when < time.time() - 86400:
+            return
+        if fields[2] != '%r' % (self.default_sample_rate,):
+            return
+        self.sample_rate = rate
+
+    def write_sample_rate(self, rate):
+        """Stores the sampling rate sent by the drop point for future runs.
+        """
+        rate_file = os.path.join(self.location, 'sample_rate')
+        with open(rate_file, 'w') as fp:
+            fp.write('%r %d %r\n' % (rate, time.time(),
+                                     self.default_sample_rate))
+        self.sample_rate = rate
+
+    @staticmethod
+    def _parse_sample_rate(value):
+        try:
+            rate = float(value.strip())
+        except (AttributeError, ValueError):
+            return None
+        if not 0.0 <= rate <= 1.0:
+            return None
+        return rate
+
+    def _update_sample_rate(self, headers):
+        headers = dict((k.lower(), v) for k, v in headers.items())
+        value = headers.get('x-usagestats-sample-rate')
+        if value is None:
+            return
+        rate = self._parse_sample_rate(value)
+        if rate is None:
+            logger.warning("Invalid sample rate from server: %r", value)
+        else:
+            if rate != self.sample_rate:
+                logger.info("Server set sample rate to %r", rate)
+            # Written even if unchanged, to renew it
+            self.write_sample_rate(rate)
+
+    def _is_sampled(self):
+        """Decides whether the current report should be kept.
+        """
+        if self.sample_rate is None or self.sample_rate >= 1.0:
+            return True
+        if self.user_id:
+            digest = hashlib.sha1(_encode(self.user_id)).hexdigest()
+            return int(digest[:8], 16) < self.sample_rate * 0x100000000
+        return random.random() < self.sample_rate
+
     def enable_reporting(self):
         """Call this method to explicitly enable reporting.
 
@@ -275,13 +670,240 @@ class Stats(object):
         self.status = Stats.DISABLED
         self.write_config(self.status)
         if os.path.exists(self.location):
-            old_reports = [f for f in os.listdir(self.location)
-                           if f.startswith('report_')]
+            old_reports = self._pending_reports()
             for old_filename in old_reports:
                 fullname = os.path.join(self.location, old_filename)
                 os.remove(fullname)
             logger.info("Deleted %d pending reports", len(old_reports))
 
+    @staticmethod
+    def _report_key(filename):
+        # 'report_<secs>_<msecs>.txt', milliseconds are not zero-padded
+        try:
+            secs, msecs = filename[7:-4].split('_')
+            return int(secs), int(msecs)
+        except ValueError:
+            return 0, 0
+
+    def _pending_reports(self):
+        """Lists the reports saved on disk, oldest first.
+        """
+        reports = [f for f in os.listdir(self.location)
+                   if f.startswith('report_')]
+        reports.sort(key=self._report_key)
+        return reports
+
+    def _save_report(self, filename, lines):
+        """Writes a report to disk, then enforces the pending reports limits.
+        """
+        fullname = os.path.join(self.location, filename)
+        with open(fullname, 'wb') as fp:
+            for line in lines:
+                fp.write(line)
+        self._evict_reports()
+
+    def _evict_reports(self):
+        """Deletes the oldest pending reports to stay within the limits.
+        """
+        if self.max_pending_reports is None and self.max_pending_bytes is None:
+            return
+        reports = self._pending_reports()
+        sizes = []
+        for filename in reports:
+            try:
+                sizes.append(os.path.getsize(os.path.join(self.location,
+                                                          filename)))
+            except OSError:
+                sizes.append(0)
+        total = sum(sizes)
+        evicted = 0
+        for filename, size in zip(reports, sizes):
+            count = len(reports) - evicted
+            if self.max_pending_reports is not None:
+                over = count > self.max_pending_reports
+            else:
+                over = False
+            if self.max_pending_bytes is not None:
+                over = over or total > self.max_pending_bytes
+            if not over:
+                break
+            try:
+                os.remove(os.path.join(self.location, filename))
+            except OSError:
+                pass
+            evicted += 1
+            total -= size
+        if evicted:
+            logger.info("Evicted %d old pending reports", evicted)
+
+    def _upload(self, data, timeout=1, deadline=None):
+        """Sends a single report using the transport.
+
+        Returns the headers of the response, or raises `UploadError`. If
+        `deadline` is set, the upload is abandoned at that time whatever the
+        transport is doing.
+        """
+        start = time.time()
+        try:
+            if deadline is None:
+                return self.transport.send(data, timeout)
+            return self._uploader.call(deadline, self.transport.send,
+                                       data, timeout)
+        finally:
+            self._latencies.append((start, time.time() - start))
+
+    def read_latencies(self):
+        """Reads the durations of the recent uploads.
+
+        Returns a list of ``(time, duration)`` pairs, in seconds, for the
+        uploads of the last day. Older ones are ignored, so that a slow
+        network doesn't prevent uploads forever.
+        """
+        latency_file = os.path.join(self.location, 'latency')
+        latencies = []
+        if os.path.exists(latency_file):
+            oldest = time.time() - 86400
+            with open(latency_file, 'r') as fp:
+                for line in fp:
+                    try:
+                        when, latency = line.split()
+                        when, latency = float(when), float(latency)
+                    except ValueError:
+                        continue
+                    if when >= oldest:
+                        latencies.append((when, latency))
+        return latencies
+
+    def _write_latencies(self):
+        if not self._latencies:
+            return
+        latencies = (self.read_latencies() + self._latencies)[-10:]
+        self._latencies = []
+        latency_file = os.path.join(self.location, 'latency')
+        try:
+            with open(latency_file, 'w') as fp:
+                for entry in latencies:
+                    fp.write('%d %.3f\n' % entry)
+        except (IOError, OSError):
+            logger.warning("Couldn't record upload latencies")
+
+    @staticmethod
+    def _upload_timeout(deadline, latency):
+        """Gets the timeout for the next upload, if there is time for it.
+
+        Returns None if an upload taking `latency` seconds wouldn't finish
+        before the deadline.
+        """
+        if deadline is None:
+            return 1
+        remaining = deadline - time.time()
+        if remaining <= 0 or remaining < latency:
+            return None
+        return min(1, remaining)
+
+    def _expected_latency(self):
+        """Guesses how long an upload will take, from the recent ones.
+
+        This is the median of the recent latencies, so that a single slow
+        upload doesn't prevent the next ones. If nothing was uploaded for a
+        while, returns 0 so that an upload is tried, to find out whether the
+        network got better.
+        """
+        latencies = self.read_latencies()
+        if not latencies or latencies[-1][0] < time.time() - 3600:
+            return 0
+        latencies = sorted(d for t, d in latencies)
+        return latencies[len(latencies) // 2]
+
+    def _drain_deadline(self, deadline, latency):
+        """Gets the time by which to stop uploading previous reports.
+
+        This keeps enough time before `deadline` to upload the current one.
+        """
+        drain_deadline = None
+        if self.drain_budget is not None:
+            drain_deadline = time.time() + self.drain_budget
+        if deadline is not None:
+            if drain_deadline is None:
+                drain_deadline = deadline - latency
+            else:
+                drain_deadline = min(drain_deadline, deadline - latency)
+        return drain_deadline
+
+    def _drain(self, deadline, latency):
+        """Uploads previously saved reports, oldest first.
+
+        Reports are deleted as soon as they have been received. Uploads are
+        only started if they can finish before `deadline`.
+        """
+        old_reports = self._pending_reports()
+        if self.drain_budget is None:
+            old_reports = old_reports[:4]  # Only upload 5 at a time
+        if not old_reports:
+            return
+
+        responses = []
+        lock = threading.Lock()
+        remaining = iter(old_reports)
+        serial = self.drain_workers <= 1
+
+        def upload_next(hard_deadline):
+            with lock:
+                old_filename = next(remaining, None)
+            if old_filename is None:
+                return False
+            timeout = self._upload_timeout(deadline, latency)
+            if timeout is None:
+                return False
+            fullname = os.path.join(self.location, old_filename)
+            try:
+                with open(fullname, 'rb') as fp:
+                    # `data=fp` would make requests stream, which is currently
+                    # not a good idea (WSGI chokes on it)
+                    responses.append(self._upload(fp.read(), timeout,
+                                                  hard_deadline))
+            except ReportRejected as e:
+                logger.warning("Server rejected report %s, deleting: %s",
+                               old_filename, str(e))
+                os.remove(fullname)
+                return True
+            except Exception as e:
+                logger.warning("Couldn't upload %s: %s", old_filename, str(e))
+                return not serial
+            else:
+                logger.info("Submitted report %s", old_filename)
+                os.remove(fullname)
+                return True
+
+        def worker(hard_deadline=None):
+            while upload_next(hard_deadline):
+                pass
+
+        if serial:
+            worker(deadline)
+        else:
+            # The workers are abandoned if they run past the deadline, they
+            # won't start new uploads after it
+            threads = []
+            for _ in range(min(self.drain_workers, len(old_reports))):
+                thread = threading.Thread(target=worker)
+                thread.daemon = True
+                try:
+                    thread.start()
+                except RuntimeError:
+                    # Interpreter is shutting down, do the rest from here
+                    worker(deadline)
+                    break
+                threads.append(thread)
+            for thread in threads:
+                if deadline is None:
+                    thread.join()
+                else:
+                    thread.join(max(0, deadline - time.time()))
+
+        for headers in list(responses):
+            self._update_sample_rate(headers)
+
     @staticmethod
     def _to_notes(info):
         if hasattr(info, 'iteritems'):
@@ -302,6 +924,54 @@ class Stats(object):
                 raise ValueError("This report has already been submitted")
             self.notes.extend(self._to_notes(info))
 
+    def auto_submit(self, info, *flags, **kwargs):
+        """Submit the report automatically when the program exits.
+
+        The report is submitted with the given info and flags when the
+        interpreter exits, or when the process receives SIGTERM, unless
+        `submit()` was called before. You can keep calling `note()` until
+        then.
+
+        :param budget: Maximum time in seconds to spend submitting, 0.5 by
+        default. Uploads are only attempted if the latencies of previous
+        uploads suggest they will finish in time, and are abandoned if they
+        don't; the report is then saved to be uploaded by a later run.
+        """
+        budget = kwargs.pop('budget', 0.5)
+        if kwargs:
+            raise TypeError("Unexpected arguments: %s" % ', '.join(kwargs))
+        first = self._auto_submit is None
+        self._auto_submit = info, flags, budget
+        if not first:
+            return
+
+        import atexit
+        atexit.register(self._run_auto_submit)
+
+        try:
+            previous = signal.getsignal(signal.SIGTERM)
+            if previous != signal.SIG_IGN:
+                def handler(signum, frame):
+                    self._run_auto_submit()
+                    if callable(previous):
+                        previous(signum, frame)
+                    else:
+                        signal.signal(signum, signal.SIG_DFL)
+                        os.kill(os.getpid(), signum)
+
+                signal.signal(signal.SIGTERM, handler)
+        except ValueError:  # Not on the main thread
+            pass
+
+    def _run_auto_submit(self):
+        if self.notes is None or self._auto_submit is None:
+            return
+        info, flags, budget = self._auto_submit
+        try:
+            self._submit(info, flags, time.time() + budget)
+        except Exception:
+            logger.exception("Couldn't submit usage statistics")
+
     def submit(self, info, *flags):
         """Finish recording and upload or save the report.
 
@@ -311,6 +981,9 @@ class Stats(object):
         uploaded too. If uploading is not explicitly enabled or disabled, the
         prompt will be shown, to ask the user to enable or disable it.
         """
+        self._submit(info, flags, None)
+
+    def _submit(self, info, flags, deadline):
         if not self.recording:
             return
         env_val = os.environ.get(self.env_var, '').lower()
@@ -322,10 +995,25 @@ class Stats(object):
         if self.notes is None:
             raise ValueError("This report has already been submitted")
 
-        all_info, self.notes = self.notes, None
+        if not self._is_sampled():
+            logger.debug("Report not sampled, discarding")
+            self.notes = None
+            if self.sending:
+                # Still send the reports saved by previous runs
+                latency = 0
+                if deadline is not None:
+                    latency = self._expected_latency()
+                self._drain(self._drain_deadline(deadline, latency), latency)
+                self._write_latencies()
+            else:
+                sys.stderr.write(self.prompt.prompt)
+            return
+
+        all_info = list(self.notes)
         all_info.extend(self._to_notes(info))
         for flag in flags:
             flag(self, all_info)
+        self.notes = None
 
         now = time.time()
         secs = int(now)
@@ -335,6 +1023,9 @@ class Stats(object):
         if self.user_id:
             all_info.insert(1, ('user', self.user_id))
 
+        if self.sample_rate is not None:
+            all_info.append(('sample_rate', '%r' % self.sample_rate))
+
         logger.debug("Generated report:\n%r", (all_info,))
 
         # Current report
@@ -345,51 +1036,45 @@ class Stats(object):
 
         # Save current report and exit, unless user has opted in
         if not self.sending:
-            fullname = os.path.join(self.location, filename)
-            with open(fullname, 'wb') as fp:
-                for line in generator():
-                    fp.write(line)
+            self._save_report(filename, generator())
 
             # Show prompt
             sys.stderr.write(self.prompt.prompt)
             return
 
-        # Post previous reports
-        old_reports = [f for f in os.listdir(self.location)
-                       if f.startswith('report_')]
-        old_reports.sort()
-        old_reports = old_reports[:4]  # Only upload 5 at a time
-        for old_filename in old_reports:
-            fullname = os.path.join(self.location, old_filename)
-            try:
-                with open(fullname, 'rb') as fp:
-                    # `data=fp` would make requests stream, which is currently
-                    # not a good idea (WSGI chokes on it)
-                    r = requests.post(self.drop_point, data=fp.read(),
-                                      timeout=1, verify=self.ssl_verify)
-                    r.raise_for_status()
-            except Exception as e:
-                logger.warning("Couldn't upload %s: %s", old_filename, str(e))
-                break
-            else:
-                logger.info("Submitted report %s", old_filename)
-                os.remove(fullname)
-
-        # Post current report
+        handled = False
         try:
-            # `data=generator()` would make requests stream, which is currently
-            # not a good idea (WSGI chokes on it)
-            r = requests.post(self.drop_point, data=b''.join(generator()),
-                              timeout=1, verify=self.ssl_verify)
-        except requests.RequestException as e:
-            logger.warning("Couldn't upload report: %s", str(e))
-            fullname = os.path.join(self.location, filename)
-            with open(fullname, 'wb') as fp:
-                for line in generator():
-                    fp.write(line)
-        else:
+            # Guess how long uploads will take, to stay within the deadline
+            latency = 0
+            if deadline is not None:
+                latency = self._expected_latency()
+
+            # Post previous reports, keeping time for the current one
+            self._drain(self._drain_deadline(deadline, latency), latency)
+
+            # Post current report
+            timeout = self._upload_timeout(deadline, latency)
             try:
-                r.raise_for_status()
-                logger.info("Submitted report")
-            except requests.RequestException as e:
+                if timeout is None:
+                    raise UploadError("not enough time left")
+                # `data=generator()` would make requests stream, which is
+                # currently not a good idea (WSGI chokes on it)
+                headers = self._upload(b''.join(generator()), timeout,
+                                       deadline)
+            except ReportRejected as e:
+                handled = True
                 logger.warning("Server rejected report: %s", str(e))
+            except UploadError as e:
+                handled = True
+                logger.warning("Couldn't upload report: %s", str(e))
+                self._save_report(filename, generator())
+            else:
+                handled = True
+                logger.info("Submitted report")
+                self._update_sample_rate(headers)
+            self._write_latencies()
+        except BaseException:
+            # Don't lose the report, whatever happened
+            if not handled:
+                self._save_report(filename, generator())
+            raise